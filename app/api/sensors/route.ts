@@ -22,8 +22,17 @@ async function getDbConnection() {
     SQL = await initSqlJs({ wasmBinary });
   }
 
-  // Read the database file
+  // Read the database file. The subscriber runs SQLite in WAL mode and sql.js
+  // only sees this main file, not the -wal file, so the newest readings appear
+  // once the subscriber checkpoints (every CHECKPOINT_SECONDS, 10 s by default).
   const filebuffer = fs.readFileSync(dbPath);
+
+  // Mark our in-memory copy as a rollback-journal database so sql.js doesn't
+  // look for a WAL it can't read (header bytes 18/19 are 2 in WAL mode)
+  if (filebuffer[18] === 2 && filebuffer[19] === 2) {
+    filebuffer[18] = 1;
+    filebuffer[19] = 1;
+  }
   
   // Create a new database instance from the buffer
   const db = new SQL.Database(filebuffer);
@@ -34,14 +43,16 @@ export async function GET() {
   try {
     const db = await getDbConnection();
     
+    // timestamp is stored as epoch microseconds
     const query = `
       SELECT id, sensor_name, sensor_type, value, unit, timestamp
       FROM sensor_readings
-      WHERE timestamp > datetime('now', '-24 hours')
+      WHERE timestamp > ?
       ORDER BY timestamp DESC
     `;
     
     const stmt = db.prepare(query);
+    stmt.bind([(Date.now() - 24 * 60 * 60 * 1000) * 1000]);
     const rows: any[] = [];
     
     while (stmt.step()) {
@@ -59,14 +70,14 @@ export async function GET() {
           sensors[sensor_name] = { history: [] };
         }
 
-        const tStamp = new Date(timestamp as string).getTime();
+        const tStamp = Math.floor((timestamp as number) / 1000);
 
         // Assign latest temperature / humidity if not already set
         if (!sensors[sensor_name][sensor_type]) {
           sensors[sensor_name][sensor_type] = {
             value,
             unit,
-            timestamp
+            timestamp: new Date(tStamp).toISOString()
           };
         }
 
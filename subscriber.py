@@ -16,24 +16,101 @@ import paho.mqtt.client as mqtt
 import sqlite3
 import json
 import logging
-from datetime import datetime
+import itertools
+import math
+import multiprocessing
+import os
+import re
+import signal
+import threading
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import time
 
+from typing import Optional, Union
+
+# msgspec decodes payloads straight into a typed struct; otherwise orjson
+# parses bytes directly and is much faster than the stdlib fallback
+try:
+    import msgspec
+    JSONDecodeError = msgspec.DecodeError  # also covers ValidationError
+except ImportError:
+    msgspec = None
+    try:
+        import orjson
+        json_loads = orjson.loads
+        JSONDecodeError = orjson.JSONDecodeError
+    except ImportError:
+        json_loads = json.loads
+        JSONDecodeError = json.JSONDecodeError
+
 # ===== CONFIGURATION =====
 MQTT_BROKER = "raspberrypi239.local"  # IP of Raspberry Pi running Mosquitto
 MQTT_PORT = 1883
 MQTT_KEEPALIVE = 60
+MQTT_MAX_INFLIGHT = 256
 
 # Database file location
 DB_FILE = "sensor_data.db"
 
+# Write batching: the writer thread commits up to BATCH_MAX rows at once,
+# and once the queue is drained waits BATCH_MS milliseconds for more
+BATCH_MAX = 500
+BATCH_MS = 200
+
+# Readings waiting for the writer; beyond this, new readings are dropped so
+# the MQTT network thread never blocks on a slow disk
+WRITE_QUEUE_MAX = 50_000
+
+# The dashboard API reads the main database file directly and never sees the
+# WAL, so new readings show up there only after a checkpoint. Checkpointing
+# every CHECKPOINT_SECONDS bounds how stale the dashboard can be.
+CHECKPOINT_SECONDS = 10
+CHECKPOINT_RETRIES = 3  # attempts per interval before waiting for the next one
+
+# Interval for the summary printed to the log
+SUMMARY_SECONDS = 60
+
+# Readings are sharded into one table per day (sensor_readings_YYYYMMDD)
+# behind a sensor_readings view. Shards older than SHARD_DAYS_KEPT days are
+# folded into the archive table so the view stays a short UNION ALL. The
+# main loop moves at most ARCHIVE_CHUNKS_PER_TICK chunks of
+# ARCHIVE_CHUNK_ROWS rows per tick, taking the write lock per chunk, so the
+# writer never waits behind a whole day's worth of copying.
+ARCHIVE_TABLE = "sensor_readings_archive"
+SHARD_GLOB = "sensor_readings_[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]"
+SHARD_DAYS_KEPT = 30
+ARCHIVE_CHUNK_ROWS = 10_000
+ARCHIVE_CHUNKS_PER_TICK = 20
+READINGS_COLUMNS = "id, sensor_name, sensor_type, value, unit, timestamp, received_at"
+
+# Insert statement reused for every batch (sqlite3 caches the prepared statement)
+INSERT_SQL = (
+    "INSERT INTO {table}(sensor_name,sensor_type,value,unit,timestamp) "
+    "VALUES (?,?,?,?,?)"
+)
+
+# Subscriber processes (opt-in, e.g. SUBSCRIBER_WORKERS=4). With more than
+# one, each worker joins the MQTT shared subscription group SHARED_GROUP
+# (the broker must support $share/...) and the broker splits messages
+# between them. All workers share the database's single write lock, and
+# each worker's summary only covers the readings it stored since start.
+WORKERS = 1  # set from SUBSCRIBER_WORKERS in main()
+SHARED_GROUP = "bitcamp"
+
 # Topics to subscribe to (using wildcards)
 TOPICS = [
     ("sensors/+/temperature", 0),
     ("sensors/+/humidity", 0),
 ]
 
+# Topic format: sensors/SENSOR_NAME/SENSOR_TYPE
+TOPIC_RE = re.compile(r"^sensors/([^/]+)/([^/]+)$")
+TOPIC_PREFIX_LEN = len("sensors/")
+TEMPERATURE_SUFFIX_LEN = len("/temperature")
+HUMIDITY_SUFFIX_LEN = len("/humidity")
+
 # ===== LOGGING SETUP =====
 logging.basicConfig(
     level=logging.INFO,
@@ -43,46 +120,85 @@ logger = logging.getLogger(__name__)
 
 # ===== GLOBAL STATE =====
 mqtt_client = None
+worker_index = 0
 db_connection = None
+read_connection = None
+current_day = None
+insert_sql = None
+multi_insert_sql = None
+rows_per_insert = 1
 messages_received = 0
+messages_dropped = 0
+write_queue = deque()  # append/popleft are atomic, no lock needed
+writer_thread = None
+writer_stop = threading.Event()
+db_lock = threading.Lock()  # serialises writer batches and WAL checkpoints
+
+# Running aggregates per (sensor_name, sensor_type): [count, min, max, sum]
+stats = defaultdict(lambda: [0, math.inf, -math.inf, 0.0])
+stats_lock = threading.Lock()
 
 
 # ===== DATABASE SETUP =====
 def init_database():
     """Initialize SQLite database with schema"""
-    global db_connection
+    global db_connection, read_connection, writer_thread, rows_per_insert
     
     try:
         db_connection = sqlite3.connect(DB_FILE, check_same_thread=False)
-        cursor = db_connection.cursor()
         
-        # Create table if it doesn't exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sensor_readings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sensor_name TEXT NOT NULL,
-                sensor_type TEXT NOT NULL,  -- 'temperature' or 'humidity'
-                value REAL NOT NULL,
-                unit TEXT NOT NULL,
-                timestamp DATETIME NOT NULL,
-                received_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        # WAL + synchronous=NORMAL: commits append to the WAL without a
+        # full fsync, and readers no longer block the writer
+        db_connection.execute("PRAGMA journal_mode=WAL")
+        db_connection.execute("PRAGMA synchronous=NORMAL")
+        db_connection.execute("PRAGMA temp_store=MEMORY")
+        db_connection.execute("PRAGMA cache_size=-65536")  # 64 MB
+        db_connection.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        db_connection.execute("PRAGMA busy_timeout=5000")
         
-        # Create index on timestamp for efficient queries
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_timestamp 
-            ON sensor_readings(timestamp)
-        ''')
+        # No inline auto-checkpoints on commit; the main loop runs
+        # checkpoint_wal() every CHECKPOINT_SECONDS instead
+        db_connection.execute("PRAGMA wal_autocheckpoint=0")
         
-        # Create index on sensor_name for filtering
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_sensor_name 
-            ON sensor_readings(sensor_name)
-        ''')
+        # Databases from before sharding have a plain sensor_readings table;
+        # fold it into the archive so the name is free for the view
+        row = db_connection.execute(
+            "SELECT type FROM sqlite_master WHERE name = 'sensor_readings'"
+        ).fetchone()
+        if row is not None and row[0] == "table":
+            migrate_monolithic_table()
+        
+        create_shard(ARCHIVE_TABLE)
+        
+        # Full batches go in as multi-row INSERTs, sized to stay within
+        # SQLite's bound-parameter limit (5 parameters per row)
+        try:
+            max_variables = db_connection.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+        except AttributeError:  # Python < 3.11
+            max_variables = 999
+        rows_per_insert = max(1, min(BATCH_MAX, max_variables // 5))
+        
+        # Create today's shard and the sensor_readings view over all shards
+        rotate_shard(time.strftime("%Y%m%d"))
+        
+        # Separate read-only connection for summary queries so they don't
+        # share the writer's connection (WAL lets both run concurrently)
+        read_connection = sqlite3.connect(
+            f"{Path(DB_FILE).resolve().as_uri()}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        read_connection.execute("PRAGMA query_only=1")
+        
+        # Flush schema changes into the main file so the dashboard sees them
+        checkpoint_wal()
         
-        db_connection.commit()
         logger.info(f"✓ Database initialized: {DB_FILE}")
+        
+        # Start background writer that batches inserts into one transaction
+        writer_stop.clear()
+        writer_thread = threading.Thread(target=writer_loop, daemon=True)
+        writer_thread.start()
         return True
         
     except sqlite3.Error as e:
@@ -93,62 +209,354 @@ def init_database():
         return False
 
 
+def create_shard(table):
+    """Create a readings table and its indexes if they don't exist"""
+    # timestamp is epoch microseconds (smaller rows, integer comparisons)
+    db_connection.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            sensor_name TEXT NOT NULL,
+            sensor_type TEXT NOT NULL,  -- 'temperature' or 'humidity'
+            value REAL NOT NULL,
+            unit TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            received_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Index on timestamp for the dashboard's time-range queries
+    db_connection.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_{table}_timestamp
+        ON {table}(timestamp)
+    ''')
+    
+    # Composite covering index for per-sensor lookups (latest reading)
+    db_connection.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_{table}_name_type_ts
+        ON {table}(sensor_name, sensor_type, timestamp DESC, value, unit)
+    ''')
+
+
+def readings_tables(connection):
+    """List the archive table followed by the daily shards, oldest first"""
+    return [ARCHIVE_TABLE] + [
+        name for (name,) in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name",
+            (SHARD_GLOB,),
+        )
+    ]
+
+
+def rebuild_view():
+    """Recreate the sensor_readings view as a UNION ALL of the archive and all shards"""
+    tables = readings_tables(db_connection)
+    selects = "\n        UNION ALL ".join(
+        f"SELECT {READINGS_COLUMNS} FROM {table}" for table in tables
+    )
+    db_connection.execute("DROP VIEW IF EXISTS sensor_readings")
+    db_connection.execute(f"CREATE VIEW sensor_readings AS\n        {selects}")
+
+
+def archive_old_shards(day):
+    """Fold shards more than SHARD_DAYS_KEPT days older than `day` into the archive
+    
+    Bounded per call; whatever is left is picked up on the next tick.
+    """
+    cutoff = (datetime.strptime(day, "%Y%m%d") - timedelta(days=SHARD_DAYS_KEPT)).strftime("%Y%m%d")
+    cutoff_table = f"sensor_readings_{cutoff}"
+    
+    # Cheap check on the read connection so the common case takes no write lock
+    if read_connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name GLOB ? AND name < ?",
+        (SHARD_GLOB, cutoff_table),
+    ).fetchone() is None:
+        return
+    
+    for _ in range(ARCHIVE_CHUNKS_PER_TICK):
+        with db_lock:
+            if not archive_chunk(cutoff_table):
+                return
+
+
+def archive_chunk(cutoff_table):
+    """Move one chunk of the oldest expired shard into the archive; False once none are left"""
+    table = None
+    db_connection.execute("BEGIN IMMEDIATE")
+    try:
+        row = db_connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? AND name < ? "
+            "ORDER BY name LIMIT 1",
+            (SHARD_GLOB, cutoff_table),
+        ).fetchone()
+        if row is None:
+            db_connection.commit()
+            return False
+        
+        table = row[0]
+        last_id = db_connection.execute(
+            f"SELECT MAX(id) FROM (SELECT id FROM {table} ORDER BY id LIMIT ?)",
+            (ARCHIVE_CHUNK_ROWS,),
+        ).fetchone()[0]
+        if last_id is None:
+            db_connection.execute(f"DROP TABLE {table}")
+            rebuild_view()
+        else:
+            # Shard ids restart every day, so let the archive assign new ones
+            db_connection.execute(f'''
+                INSERT INTO {ARCHIVE_TABLE}
+                (sensor_name, sensor_type, value, unit, timestamp, received_at)
+                SELECT sensor_name, sensor_type, value, unit, timestamp, received_at
+                FROM {table} WHERE id <= ?
+            ''', (last_id,))
+            db_connection.execute(f"DELETE FROM {table} WHERE id <= ?", (last_id,))
+        db_connection.commit()
+    except sqlite3.Error:
+        db_connection.rollback()
+        raise
+    
+    if last_id is None:
+        logger.info(f"✓ Archived shard {table}")
+    return True
+
+
+def rotate_shard(day):
+    """Start writing to the shard for `day` (YYYYMMDD) and rebuild the view"""
+    global current_day, insert_sql, multi_insert_sql
+    
+    table = f"sensor_readings_{day}"
+    db_connection.execute("BEGIN IMMEDIATE")
+    try:
+        create_shard(table)
+        rebuild_view()
+        db_connection.commit()
+    except sqlite3.Error:
+        db_connection.rollback()
+        raise
+    
+    current_day = day
+    insert_sql = INSERT_SQL.format(table=table)
+    multi_insert_sql = insert_sql + ",(?,?,?,?,?)" * (rows_per_insert - 1)
+
+
+def needs_timestamp_migration():
+    """Check whether sensor_readings still has the old text timestamp column"""
+    for _cid, name, col_type, *_rest in db_connection.execute("PRAGMA table_info(sensor_readings)"):
+        if name == "timestamp":
+            return col_type.upper() != "INTEGER"
+    return False
+
+
+def migrate_monolithic_table():
+    """Move rows from the pre-sharding sensor_readings table into the archive"""
+    # Older databases also stored timestamp as ISO text; convert while copying
+    if needs_timestamp_migration():
+        db_connection.create_function("legacy_epoch_us", 2, legacy_epoch_us, deterministic=True)
+        timestamp_expr = "legacy_epoch_us(timestamp, received_at)"
+    else:
+        timestamp_expr = "timestamp"
+    
+    db_connection.execute("BEGIN IMMEDIATE")
+    try:
+        db_connection.execute("ALTER TABLE sensor_readings RENAME TO sensor_readings_legacy")
+        for index in ("idx_timestamp", "idx_sensor_name", "idx_name_type_ts"):
+            db_connection.execute(f"DROP INDEX IF EXISTS {index}")
+        
+        create_shard(ARCHIVE_TABLE)
+        total = db_connection.execute("SELECT COUNT(*) FROM sensor_readings_legacy").fetchone()[0]
+        migrated = db_connection.execute(f'''
+            INSERT INTO {ARCHIVE_TABLE} ({READINGS_COLUMNS})
+            SELECT * FROM (
+                SELECT id, sensor_name, sensor_type, value, unit,
+                       {timestamp_expr} AS timestamp, received_at
+                FROM sensor_readings_legacy
+            ) WHERE timestamp IS NOT NULL
+        ''').rowcount
+        db_connection.execute("DROP TABLE sensor_readings_legacy")
+        db_connection.commit()
+    except sqlite3.Error:
+        db_connection.rollback()
+        raise
+    
+    logger.info(f"✓ Migrated {migrated} readings to {ARCHIVE_TABLE}")
+    if migrated < total:
+        logger.warning(f"Skipped {total - migrated} legacy readings with unparseable timestamps")
+
+
+def legacy_epoch_us(timestamp, received_at):
+    """Migration converter: the payload timestamp, else received_at, else None
+    
+    Legacy rows stored whatever the publisher sent, so a malformed timestamp
+    must not abort the whole migration. received_at is SQLite's
+    CURRENT_TIMESTAMP, i.e. UTC text.
+    """
+    try:
+        return to_epoch_us(timestamp)
+    except (ValueError, TypeError):
+        pass
+    try:
+        received = datetime.fromisoformat(received_at).replace(tzinfo=timezone.utc)
+        return round(received.timestamp() * 1_000_000)
+    except (ValueError, TypeError):
+        return None
+
+
+def to_epoch_us(timestamp):
+    """Convert a payload timestamp (or None) to integer epoch microseconds
+    
+    Expected: an ISO-8601 string. Numeric epoch timestamps are also accepted
+    in seconds, milliseconds, microseconds or nanoseconds, told apart by
+    magnitude (any date between 1973 and 5138 is unambiguous).
+    """
+    if timestamp is None:
+        return time.time_ns() // 1000
+    if isinstance(timestamp, bool):
+        raise ValueError(f"invalid timestamp: {timestamp!r}")
+    if isinstance(timestamp, (int, float)):
+        magnitude = abs(timestamp)
+        if magnitude < 1e11:
+            return round(timestamp * 1_000_000)  # seconds
+        if magnitude < 1e14:
+            return round(timestamp * 1_000)  # milliseconds
+        if magnitude < 1e17:
+            return int(timestamp)  # microseconds
+        return int(timestamp) // 1_000  # nanoseconds
+    return round(datetime.fromisoformat(timestamp).timestamp() * 1_000_000)
+
+
+# ===== PAYLOAD DECODING =====
+if msgspec is not None:
+    class Reading(msgspec.Struct):
+        """Sensor payload: {"value": .., "unit": .., "timestamp": ..}"""
+        value: Optional[float] = None
+        unit: Optional[str] = ""
+        timestamp: Union[str, float, None] = None
+    
+    _reading_decoder = msgspec.json.Decoder(Reading, strict=False)  # accept "23.5" like float()
+    
+    def decode_reading(payload):
+        """Decode a JSON payload into (value, unit, timestamp)"""
+        reading = _reading_decoder.decode(payload)
+        return reading.value, reading.unit, reading.timestamp
+else:
+    def decode_reading(payload):
+        """Decode a JSON payload into (value, unit, timestamp)"""
+        payload = json_loads(payload)
+        if not isinstance(payload, dict):
+            # Same outcome as the msgspec path: an invalid payload, not a crash
+            raise JSONDecodeError("Expected a JSON object", "", 0)
+        return payload.get('value'), payload.get('unit', ''), payload.get('timestamp')
+
+
 # ===== MQTT CALLBACKS =====
-def on_connect(client, userdata, flags, rc):
+def on_connect(client, userdata, flags, reason_code, properties):
     """Called when client connects to MQTT broker"""
-    if rc == 0:
+    if reason_code == 0:
         logger.info(f"✓ Connected to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}")
         
-        # Subscribe to all sensor topics
+        # Subscribe to all sensor topics (as a shared group when running workers)
         for topic, qos in TOPICS:
+            if WORKERS > 1:
+                topic = f"$share/{SHARED_GROUP}/{topic}"
             result = client.subscribe(topic, qos=qos)
             if result[0] == mqtt.MQTT_ERR_SUCCESS:
                 logger.info(f"  ✓ Subscribed to: {topic}")
             else:
                 logger.warning(f"  ✗ Failed to subscribe to: {topic}")
     else:
-        logger.error(f"✗ Connection failed. Code: {rc}")
+        logger.error(f"✗ Connection failed. Code: {reason_code}")
 
 
-def on_disconnect(client, userdata, rc):
+def on_disconnect(client, userdata, disconnect_flags, reason_code, properties):
     """Called when client disconnects"""
-    if rc != 0:
-        logger.warning(f"Unexpected disconnection. Code: {rc}")
+    if reason_code != 0:
+        logger.warning(f"Unexpected disconnection. Code: {reason_code}")
+
+
+def on_temperature(client, userdata, msg):
+    """Called for messages on sensors/+/temperature"""
+    global messages_received
+    messages_received += 1
+    
+    # The subscription guarantees the topic shape, so slice out the name;
+    # "+" still matches an empty level (sensors//temperature)
+    sensor_name = msg.topic[TOPIC_PREFIX_LEN:-TEMPERATURE_SUFFIX_LEN]
+    if not sensor_name:
+        logger.warning(f"Unexpected topic format: {msg.topic}")
+        return
+    handle_reading(msg, sensor_name, "temperature")
+
+
+def on_humidity(client, userdata, msg):
+    """Called for messages on sensors/+/humidity"""
+    global messages_received
+    messages_received += 1
+    
+    sensor_name = msg.topic[TOPIC_PREFIX_LEN:-HUMIDITY_SUFFIX_LEN]
+    if not sensor_name:
+        logger.warning(f"Unexpected topic format: {msg.topic}")
+        return
+    handle_reading(msg, sensor_name, "humidity")
 
 
 def on_message(client, userdata, msg):
-    """Called when a message is received"""
+    """Called for messages not matched by a per-type callback"""
     global messages_received
+    messages_received += 1
     
+    # Parse topic to extract sensor name and type
+    match = TOPIC_RE.match(msg.topic)
+    if match is None:
+        logger.warning(f"Unexpected topic format: {msg.topic}")
+        return
+    
+    sensor_name, sensor_type = match.groups()
+    handle_reading(msg, sensor_name, sensor_type)
+
+
+def handle_reading(msg, sensor_name, sensor_type):
+    """Decode a reading payload and queue it for storage"""
     try:
-        messages_received += 1
-        
-        # Parse topic to extract sensor name and type
-        # Topic format: sensors/SENSOR_NAME/SENSOR_TYPE
-        topic_parts = msg.topic.split('/')
-        if len(topic_parts) != 3:
-            logger.warning(f"Unexpected topic format: {msg.topic}")
-            return
-        
-        sensor_name = topic_parts[1]
-        sensor_type = topic_parts[2]  # 'temperature' or 'humidity'
-        
         # Parse payload (should be JSON)
-        payload = json.loads(msg.payload.decode())
-        value = payload.get('value')
-        unit = payload.get('unit', '')
-        timestamp = payload.get('timestamp', datetime.now().isoformat())
+        value, unit, timestamp = decode_reading(msg.payload)
+        if timestamp is None:
+            timestamp = time.time_ns() // 1000  # no datetime object needed
+        else:
+            try:
+                timestamp = to_epoch_us(timestamp)
+            except (TypeError, ValueError):
+                logger.warning(f"Invalid timestamp in payload from {msg.topic}: {timestamp!r}")
+                return
         
         # Validate data
         if value is None:
             logger.warning(f"No value in payload from {msg.topic}")
             return
         
+        # Booleans and inf/nan would otherwise be stored and skew min/max/avg
+        try:
+            if isinstance(value, bool):
+                raise TypeError
+            value = float(value)
+            if not math.isfinite(value):
+                raise ValueError
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid value in payload from {msg.topic}: {value!r}")
+            return
+        
+        if unit is None:
+            unit = ''
+        elif not isinstance(unit, str):
+            logger.warning(f"Invalid unit in payload from {msg.topic}: {unit!r}")
+            return
+        
         # Store in database
         if store_reading(sensor_name, sensor_type, value, unit, timestamp):
-            logger.info(f"[{messages_received:04d}] {sensor_name:15} | {sensor_type:10} = {value:6.1f} {unit}")
+            # Hot path: skip formatting entirely when INFO is disabled
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("[%04d] %-15s | %-10s = %6.1f %s",
+                            messages_received, sensor_name, sensor_type, value, unit)
         
-    except json.JSONDecodeError:
+    except (JSONDecodeError, UnicodeDecodeError):
         logger.warning(f"Invalid JSON payload from {msg.topic}: {msg.payload}")
     except Exception as e:
         logger.error(f"Error processing message from {msg.topic}: {e}")
@@ -156,46 +564,196 @@ def on_message(client, userdata, msg):
 
 # ===== DATABASE OPERATIONS =====
 def store_reading(sensor_name, sensor_type, value, unit, timestamp):
-    """Store a sensor reading in the database"""
+    """Queue a sensor reading for the background writer"""
+    global messages_dropped
+    
     if db_connection is None:
         logger.error("Database not initialized")
         return False
     
+    if len(write_queue) >= WRITE_QUEUE_MAX:
+        # Sensor data is non-critical: drop rather than stall the network thread
+        messages_dropped += 1
+        if messages_dropped % 1000 == 1:
+            logger.warning(f"Write queue full, dropping readings ({messages_dropped} dropped so far)")
+        return False
+    
+    write_queue.append((sensor_name, sensor_type, value, unit, timestamp))
+    return True
+
+
+def collect_batch():
+    """Take up to BATCH_MAX rows off the write queue"""
+    rows = []
+    popleft = write_queue.popleft
     try:
-        cursor = db_connection.cursor()
-        cursor.execute('''
-            INSERT INTO sensor_readings 
-            (sensor_name, sensor_type, value, unit, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (sensor_name, sensor_type, value, unit, timestamp))
-        
-        db_connection.commit()
-        return True
+        while len(rows) < BATCH_MAX:
+            rows.append(popleft())
+    except IndexError:
+        pass
+    return rows
+
+
+def write_batch(rows):
+    """Insert a batch of readings in a single transaction"""
+    with db_lock:
+        try:
+            # Switch to a new shard at midnight
+            today = time.strftime("%Y%m%d")
+            if today != current_day:
+                rotate_shard(today)
+            
+            db_connection.execute("BEGIN IMMEDIATE")
+            # Whole chunks use one cached multi-row statement; the remainder
+            # goes through executemany rather than a one-off statement size
+            full = len(rows) - len(rows) % rows_per_insert
+            for start in range(0, full, rows_per_insert):
+                chunk = rows[start:start + rows_per_insert]
+                db_connection.execute(multi_insert_sql, list(itertools.chain.from_iterable(chunk)))
+            if full < len(rows):
+                db_connection.executemany(insert_sql, rows[full:])
+            db_connection.commit()
+            
+        except sqlite3.Error as e:
+            # Roll back while still holding the lock so a checkpoint can't
+            # run on the connection with this transaction open
+            logger.error(f"Database error: {e}")
+            db_connection.rollback()
+            
+            # One bad row shouldn't cost the whole batch: retry row by row
+            try:
+                rows = insert_rows_individually(rows)
+            except sqlite3.Error as e:
+                logger.error(f"Database error: {e}")
+                db_connection.rollback()
+                return False
+    
+    update_stats(rows)
+    return True
+
+
+def insert_rows_individually(rows):
+    """Insert rows one at a time, skipping any SQLite rejects; returns the stored rows"""
+    stored = []
+    db_connection.execute("BEGIN IMMEDIATE")
+    for row in rows:
+        try:
+            db_connection.execute(insert_sql, row)
+            stored.append(row)
+        except sqlite3.Error as e:
+            logger.warning(f"Dropping reading {row!r}: {e}")
+    db_connection.commit()
+    return stored
+
+
+def writer_loop():
+    """Drain the write queue into the database until asked to stop"""
+    while True:
+        rows = collect_batch()
+        if rows:
+            try:
+                write_batch(rows)
+            except Exception as e:
+                # Never let one bad batch kill the writer thread
+                logger.error(f"✗ Unexpected error writing batch of {len(rows)} readings: {e}")
         
-    except sqlite3.Error as e:
-        logger.error(f"Database error: {e}")
+        if len(rows) < BATCH_MAX:
+            # Queue drained: exit if asked to, otherwise let the next batch build up
+            if writer_stop.is_set():
+                break
+            writer_stop.wait(BATCH_MS / 1000)
+
+
+def checkpoint_wal():
+    """Copy the WAL back into the database file and truncate it"""
+    if db_connection is None:
         return False
+    
+    # With auto-checkpoint off nothing else shrinks the WAL, so retry briefly
+    # if readers or another writer keep the checkpoint from completing
+    for attempt in range(CHECKPOINT_RETRIES):
+        try:
+            with db_lock:
+                busy, log_frames, checkpointed = db_connection.execute(
+                    "PRAGMA wal_checkpoint(TRUNCATE)"
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"WAL checkpoint error: {e}")
+            return False
+        
+        if not busy:
+            return True
+        time.sleep(0.1 * (attempt + 1))
+    
+    logger.warning(f"WAL checkpoint busy: {checkpointed}/{log_frames} frames copied, "
+                   f"will retry next interval")
+    return False
+
+
+def update_stats(rows):
+    """Fold freshly written rows into the running aggregates"""
+    with stats_lock:
+        for sensor_name, sensor_type, value, _unit, _timestamp in rows:
+            s = stats[(sensor_name, sensor_type)]
+            s[0] += 1
+            s[1] = min(s[1], value)
+            s[2] = max(s[2], value)
+            s[3] += value
+
+
+def seed_stats():
+    """Load the running aggregates from the database on startup"""
+    summary = get_readings_summary()
+    if not summary:
+        return
+    
+    with stats_lock:
+        for sensor_name, sensor_type, count, min_val, max_val, avg_val in summary:
+            stats[(sensor_name, sensor_type)] = [count, min_val, max_val, avg_val * count]
+
+
+def get_stats_summary():
+    """Get summary statistics from the running aggregates, same shape as get_readings_summary"""
+    with stats_lock:
+        return [
+            (sensor_name, sensor_type, count, min_val, max_val, total / count)
+            for (sensor_name, sensor_type), (count, min_val, max_val, total)
+            in sorted(stats.items())
+        ]
 
 
 def get_latest_readings():
     """Get the latest reading from each sensor"""
-    if db_connection is None:
+    if read_connection is None:
         return None
     
     try:
-        cursor = db_connection.cursor()
-        cursor.execute('''
-            SELECT DISTINCT sensor_name, sensor_type, value, unit, timestamp
-            FROM sensor_readings
-            WHERE (sensor_name, timestamp) IN (
-                SELECT sensor_name, MAX(timestamp)
-                FROM sensor_readings
-                GROUP BY sensor_name
+        # Query each table directly: through the UNION ALL view SQLite can't
+        # use the per-table (sensor_name, sensor_type, timestamp) index
+        tables = readings_tables(read_connection)
+        # DISTINCT is answered from the same covering index
+        sensors = sorted({
+            pair for table in tables
+            for pair in read_connection.execute(
+                f"SELECT DISTINCT sensor_name, sensor_type FROM {table}"
             )
-            ORDER BY sensor_name, sensor_type
-        ''')
+        })
         
-        results = cursor.fetchall()
+        results = []
+        for sensor_name, sensor_type in sensors:
+            candidates = [
+                read_connection.execute(f'''
+                    SELECT sensor_name, sensor_type, value, unit, timestamp
+                    FROM {table}
+                    WHERE sensor_name = ? AND sensor_type = ?
+                    ORDER BY timestamp DESC
+                    LIMIT 1
+                ''', (sensor_name, sensor_type)).fetchone()
+                for table in tables
+            ]
+            candidates = [row for row in candidates if row is not None]
+            if candidates:
+                results.append(max(candidates, key=lambda row: row[4]))
         return results
     except sqlite3.Error as e:
         logger.error(f"Database query error: {e}")
@@ -204,21 +762,18 @@ def get_latest_readings():
 
 def get_readings_summary():
     """Get summary statistics of stored readings"""
-    if db_connection is None:
+    if read_connection is None:
         return None
     
     try:
-        cursor = db_connection.cursor()
-        cursor.execute('''
+        results = read_connection.execute('''
             SELECT sensor_name, sensor_type, COUNT(*) as count,
                    MIN(value) as min_val, MAX(value) as max_val,
                    AVG(value) as avg_val
             FROM sensor_readings
             GROUP BY sensor_name, sensor_type
             ORDER BY sensor_name, sensor_type
-        ''')
-        
-        results = cursor.fetchall()
+        ''').fetchall()
         return results
     except sqlite3.Error as e:
         logger.error(f"Database query error: {e}")
@@ -231,10 +786,15 @@ def init_mqtt():
     global mqtt_client
     
     try:
-        mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+        mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, transport="tcp")
+        mqtt_client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+        mqtt_client.max_queued_messages_set(0)  # 0 = unbounded
+        mqtt_client.reconnect_delay_set(min_delay=1, max_delay=30)
         mqtt_client.on_connect = on_connect
         mqtt_client.on_disconnect = on_disconnect
         mqtt_client.on_message = on_message
+        mqtt_client.message_callback_add("sensors/+/temperature", on_temperature)
+        mqtt_client.message_callback_add("sensors/+/humidity", on_humidity)
         
         mqtt_client.connect(MQTT_BROKER, MQTT_PORT, MQTT_KEEPALIVE)
         mqtt_client.loop_start()  # Start background loop
@@ -248,8 +808,28 @@ def init_mqtt():
 
 
 # ===== MAIN LOOP =====
+def parse_workers():
+    """Read the worker count from SUBSCRIBER_WORKERS; None if it isn't valid"""
+    raw = os.environ.get("SUBSCRIBER_WORKERS", "1")
+    try:
+        workers = int(raw)
+    except ValueError:
+        workers = 0
+    if workers < 1:
+        logger.error(f"✗ SUBSCRIBER_WORKERS must be a positive integer, got {raw!r}")
+        return None
+    return workers
+
+
 def main():
     """Main program loop"""
+    global WORKERS
+    
+    workers = parse_workers()
+    if workers is None:
+        return
+    WORKERS = workers
+    
     logger.info("=" * 60)
     logger.info("Bitcamp Advanced - MQTT Subscriber & Database Writer")
     logger.info("=" * 60)
@@ -260,33 +840,92 @@ def main():
         logger.info(f"  - {topic}")
     logger.info("=" * 60)
     
-    # Initialize database
+    # Initialize database once up front so migrations run in a single process
     if not init_database():
         logger.error("Cannot continue without database. Exiting.")
         return
     
-    # Initialize MQTT
-    if not init_mqtt():
-        logger.error("Cannot continue without MQTT. Exiting.")
+    if WORKERS == 1:
+        seed_stats()
+        run_worker()
         return
     
-    logger.info("✓ All systems initialized. Waiting for sensor data...")
-    logger.info("Press Ctrl+C to exit\n")
+    # Workers open their own connections; don't carry this one across fork
+    close_database(report=False)
+    
+    # Ctrl+C reaches every worker, which flushes and exits on its own; the
+    # parent just waits for them. Ignore it before starting any worker so an
+    # interrupt during startup can't kill the parent and orphan the rest.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    logger.info(f"Starting {WORKERS} workers (shared subscription group '{SHARED_GROUP}')")
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(index, WORKERS), name=f"worker-{index}")
+        for index in range(WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    
+    for worker in workers:
+        worker.join()
+    logger.info("✓ All workers stopped")
+
+
+def run_worker(index=0, workers=1):
+    """Subscribe and store readings until interrupted, printing a summary every minute"""
+    global worker_index, WORKERS
+    worker_index = index
+    WORKERS = workers
+    
+    # Worker processes inherit the parent's ignored SIGINT; take Ctrl+C again
+    if workers > 1:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+    
+    if db_connection is None and not init_database():
+        logger.error(f"Worker {index}: cannot continue without database. Exiting.")
+        return
     
     try:
+        # Initialize MQTT (inside the try so Ctrl+C while connecting still cleans up)
+        if not init_mqtt():
+            logger.error("Cannot continue without MQTT. Exiting.")
+            return
+        
+        logger.info("✓ All systems initialized. Waiting for sensor data...")
+        logger.info("Press Ctrl+C to exit\n")
+        
+        next_summary = time.monotonic() + SUMMARY_SECONDS
         while True:
-            time.sleep(60)  # Print stats every minute
+            time.sleep(CHECKPOINT_SECONDS)
+            
+            # Keep the main database file current for the dashboard
+            checkpoint_wal()
+            
+            try:
+                archive_old_shards(time.strftime("%Y%m%d"))
+            except sqlite3.Error as e:
+                logger.warning(f"Archiving old shards failed, will retry: {e}")
+            
+            if time.monotonic() < next_summary:
+                continue
+            next_summary = time.monotonic() + SUMMARY_SECONDS
             
-            # Print current data summary
-            summary = get_readings_summary()
+            # Print current data summary (per worker when running several)
+            summary = get_stats_summary()
             if summary:
-                logger.info("--- Database Summary ---")
+                if WORKERS > 1:
+                    logger.info(f"--- Worker {worker_index} Summary (readings stored by this worker since start) ---")
+                else:
+                    logger.info("--- Database Summary ---")
                 for row in summary:
                     sensor_name, sensor_type, count, min_val, max_val, avg_val = row
                     logger.info(f"  {sensor_name:15} {sensor_type:10}: "
                               f"samples={count:4d} | min={min_val:6.1f} | "
                               f"max={max_val:6.1f} | avg={avg_val:6.1f}")
             
+            if messages_dropped:
+                logger.warning(f"  Dropped readings (write queue full): {messages_dropped}")
+            
     except KeyboardInterrupt:
         logger.info("\nShutdown requested...")
     except Exception as e:
@@ -306,12 +945,32 @@ def cleanup():
         mqtt_client.disconnect()
         logger.info("✓ MQTT client disconnected")
     
+    close_database()
+    
+    logger.info("✓ Shutdown complete")
+
+
+def close_database(report=True):
+    """Flush pending readings and close both database connections"""
+    global db_connection, read_connection, writer_thread
+    
+    # Flush pending readings before closing the database
+    if writer_thread:
+        writer_stop.set()
+        writer_thread.join()
+        writer_thread = None
+        logger.info("✓ Write queue flushed")
+    
     # Close database
+    if read_connection:
+        read_connection.close()
+        read_connection = None
+    
     if db_connection:
         db_connection.close()
-        logger.info(f"✓ Database closed. Total messages stored: {messages_received}")
-    
-    logger.info("✓ Shutdown complete")
+        db_connection = None
+        if report:
+            logger.info(f"✓ Database closed. Total messages stored: {messages_received}")
 
 
 # ===== ENTRY POINT =====
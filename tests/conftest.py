@@ -0,0 +1,20 @@
+import sys
+import types
+from pathlib import Path
+
+# subscriber.py is a standalone script at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# The database tests never touch the broker; stand in for paho-mqtt when it
+# isn't installed so they still run (see requirements.txt for the real thing)
+try:
+    import paho.mqtt.client  # noqa: F401
+except ImportError:
+    client = types.ModuleType("paho.mqtt.client")
+    client.CallbackAPIVersion = types.SimpleNamespace(VERSION1=1, VERSION2=2)
+    client.MQTT_ERR_SUCCESS = 0
+    client.Client = None
+    paho = types.ModuleType("paho")
+    paho.mqtt = types.ModuleType("paho.mqtt")
+    paho.mqtt.client = client
+    sys.modules.update({"paho": paho, "paho.mqtt": paho.mqtt, "paho.mqtt.client": client})
@@ -0,0 +1,337 @@
+"""Scratch-database tests for the subscriber's schema migration and daily shards"""
+
+import importlib.util
+import logging
+import sqlite3
+import sys
+import time
+import types
+
+import pytest
+
+import subscriber
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the subscriber at a scratch database and clean up afterwards"""
+    db_file = tmp_path / "sensor_data.db"
+    monkeypatch.setattr(subscriber, "DB_FILE", str(db_file))
+    subscriber.stats.clear()
+    yield db_file
+    subscriber.close_database()
+    subscriber.stats.clear()
+
+
+def set_today(monkeypatch, day):
+    """Make the writer believe the local date is `day` (YYYYMMDD)"""
+    real_strftime = time.strftime
+    monkeypatch.setattr(
+        subscriber.time, "strftime",
+        lambda fmt, *args: day if fmt == "%Y%m%d" and not args else real_strftime(fmt, *args),
+    )
+
+
+def table_names(db_file):
+    with sqlite3.connect(db_file) as conn:
+        return {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+
+
+def test_legacy_table_is_migrated_into_archive(db):
+    # Pre-sharding schema with ISO text timestamps and the old indexes
+    with sqlite3.connect(db) as conn:
+        conn.execute('''
+            CREATE TABLE sensor_readings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sensor_name TEXT NOT NULL,
+                sensor_type TEXT NOT NULL,
+                value REAL NOT NULL,
+                unit TEXT NOT NULL,
+                timestamp DATETIME NOT NULL,
+                received_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute("CREATE INDEX idx_timestamp ON sensor_readings(timestamp)")
+        conn.execute("CREATE INDEX idx_sensor_name ON sensor_readings(sensor_name)")
+        conn.executemany(
+            "INSERT INTO sensor_readings (sensor_name, sensor_type, value, unit, timestamp) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                ("rpi", "temperature", 22.5, "celsius", "2026-02-28T10:30:18.075768"),
+                ("rpi", "temperature", 23.0, "celsius", "2026-02-28T10:30:20.000000"),
+                ("rpi", "humidity", 56.0, "percent", "2026-02-28T10:30:18.075768"),
+            ],
+        )
+    
+    assert subscriber.init_database()
+    
+    names = table_names(db)
+    assert subscriber.ARCHIVE_TABLE in names
+    assert f"sensor_readings_{time.strftime('%Y%m%d')}" in names
+    assert not names & {"sensor_readings_legacy", "idx_timestamp", "idx_sensor_name"}
+    
+    rows = subscriber.read_connection.execute(
+        "SELECT sensor_name, sensor_type, value, timestamp FROM sensor_readings ORDER BY id"
+    ).fetchall()
+    assert [row[:3] for row in rows] == [
+        ("rpi", "temperature", 22.5),
+        ("rpi", "temperature", 23.0),
+        ("rpi", "humidity", 56.0),
+    ]
+    assert rows[0][3] == subscriber.to_epoch_us("2026-02-28T10:30:18.075768")
+    assert all(isinstance(row[3], int) for row in rows)
+    
+    latest = subscriber.get_latest_readings()
+    assert [(name, kind, value) for name, kind, value, _unit, _ts in latest] == [
+        ("rpi", "humidity", 56.0),
+        ("rpi", "temperature", 23.0),
+    ]
+
+
+def test_malformed_legacy_timestamps_do_not_abort_migration(db):
+    with sqlite3.connect(db) as conn:
+        conn.execute('''
+            CREATE TABLE sensor_readings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sensor_name TEXT NOT NULL,
+                sensor_type TEXT NOT NULL,
+                value REAL NOT NULL,
+                unit TEXT NOT NULL,
+                timestamp DATETIME NOT NULL,
+                received_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.executemany(
+            "INSERT INTO sensor_readings (sensor_name, sensor_type, value, unit, timestamp, received_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                ("rpi", "temperature", 22.5, "celsius", "2026-02-28T10:30:18", "2026-02-28 10:30:19"),
+                ("rpi", "temperature", 23.0, "celsius", "28/02/2026 10:30", "2026-02-28 10:30:20"),
+                ("rpi", "humidity", 56.0, "percent", "garbage", "garbage"),
+            ],
+        )
+    
+    assert subscriber.init_database()
+    assert "sensor_readings_legacy" not in table_names(db)
+    
+    rows = subscriber.read_connection.execute(
+        "SELECT value, timestamp FROM sensor_readings ORDER BY id"
+    ).fetchall()
+    # Unparseable timestamp falls back to received_at (UTC); if that is
+    # unparseable too the row is skipped
+    assert rows == [
+        (22.5, subscriber.to_epoch_us("2026-02-28T10:30:18")),
+        (23.0, subscriber.to_epoch_us("2026-02-28T10:30:20+00:00")),
+    ]
+
+
+def test_day_rollover_switches_shard_and_old_ones_get_archived(db, monkeypatch):
+    set_today(monkeypatch, "20261101")
+    assert subscriber.init_database()
+    assert subscriber.write_batch([("a", "temperature", 1.0, "c", 100)])
+    
+    # Next day: new shard, old one still visible through the view
+    set_today(monkeypatch, "20261102")
+    assert subscriber.write_batch([("a", "temperature", 2.0, "c", 200)])
+    names = table_names(db)
+    assert {"sensor_readings_20261101", "sensor_readings_20261102"} <= names
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM sensor_readings_20261102").fetchone() == (1,)
+    
+    # Rollover itself never copies old shards...
+    set_today(monkeypatch, "20261215")
+    assert subscriber.write_batch([("a", "temperature", 3.0, "c", 300)])
+    assert "sensor_readings_20261101" in table_names(db)
+    
+    # ...the main loop folds those past SHARD_DAYS_KEPT into the archive
+    subscriber.archive_old_shards("20261215")
+    names = table_names(db)
+    assert "sensor_readings_20261101" not in names
+    assert "sensor_readings_20261102" not in names
+    
+    rows = subscriber.read_connection.execute(
+        "SELECT value FROM sensor_readings ORDER BY timestamp"
+    ).fetchall()
+    assert rows == [(1.0,), (2.0,), (3.0,)]
+    assert subscriber.get_latest_readings() == [("a", "temperature", 3.0, "c", 300)]
+
+
+def test_latest_readings_cover_sensors_not_in_stats(db):
+    assert subscriber.init_database()
+    assert subscriber.write_batch([
+        ("a", "temperature", 1.0, "c", 100),
+        ("b", "humidity", 50.0, "%", 200),
+    ])
+    # Readings written by another worker process never reach this one's stats
+    subscriber.stats.pop(("b", "humidity"))
+    
+    assert subscriber.get_latest_readings() == [
+        ("a", "temperature", 1.0, "c", 100),
+        ("b", "humidity", 50.0, "%", 200),
+    ]
+
+
+def test_archiving_is_bounded_per_tick(db, monkeypatch):
+    set_today(monkeypatch, "20261101")
+    assert subscriber.init_database()
+    assert subscriber.write_batch([("a", "temperature", float(i), "c", i) for i in range(5)])
+    set_today(monkeypatch, "20261215")
+    assert subscriber.write_batch([("a", "temperature", 5.0, "c", 5)])
+    
+    monkeypatch.setattr(subscriber, "ARCHIVE_CHUNK_ROWS", 2)
+    monkeypatch.setattr(subscriber, "ARCHIVE_CHUNKS_PER_TICK", 2)
+    count = "SELECT COUNT(*) FROM {}".format
+    
+    subscriber.archive_old_shards("20261215")
+    with sqlite3.connect(db) as conn:
+        assert conn.execute(count("sensor_readings_20261101")).fetchone() == (1,)
+        assert conn.execute(count(subscriber.ARCHIVE_TABLE)).fetchone() == (4,)
+        assert conn.execute(count("sensor_readings")).fetchone() == (6,)
+    
+    # Next tick moves the last row and drops the emptied shard
+    subscriber.archive_old_shards("20261215")
+    assert "sensor_readings_20261101" not in table_names(db)
+    with sqlite3.connect(db) as conn:
+        assert conn.execute(count(subscriber.ARCHIVE_TABLE)).fetchone() == (5,)
+        assert conn.execute(count("sensor_readings")).fetchone() == (6,)
+
+
+def test_batch_uses_full_chunks_then_remainder(db):
+    assert subscriber.init_database()
+    statements = []
+    subscriber.db_connection.set_trace_callback(statements.append)
+    
+    size = subscriber.rows_per_insert
+    rows = [("a", "temperature", float(i), "c", 1000 + i) for i in range(2 * size + 3)]
+    assert subscriber.write_batch(rows)
+    subscriber.db_connection.set_trace_callback(None)
+    
+    inserts = [sql for sql in statements if sql.lstrip().startswith("INSERT")]
+    assert len(inserts) == 2 + 3  # two multi-row chunks, then one row per remainder
+    assert all(sql.count("),(") == size - 1 for sql in inserts[:2])
+    assert all("),(" not in sql for sql in inserts[2:])
+    
+    stored = subscriber.db_connection.execute(
+        "SELECT value FROM sensor_readings ORDER BY timestamp"
+    ).fetchall()
+    assert [value for (value,) in stored] == [row[2] for row in rows]
+
+
+def test_bad_row_is_dropped_without_losing_the_batch(db):
+    assert subscriber.init_database()
+    rows = [
+        ("a", "temperature", 1.0, "c", 100),
+        ("a", "temperature", None, "c", 200),  # violates NOT NULL
+        ("a", "temperature", 3.0, "c", 300),
+    ]
+    assert subscriber.write_batch(rows)
+    
+    stored = subscriber.db_connection.execute(
+        "SELECT value FROM sensor_readings ORDER BY timestamp"
+    ).fetchall()
+    assert stored == [(1.0,), (3.0,)]
+    assert subscriber.stats[("a", "temperature")] == [2, 1.0, 3.0, 4.0]
+
+
+def test_full_queue_drops_and_counts_readings(db, monkeypatch):
+    assert subscriber.init_database()
+    monkeypatch.setattr(subscriber, "WRITE_QUEUE_MAX", 0)
+    monkeypatch.setattr(subscriber, "messages_dropped", 0)
+    
+    for _ in range(3):
+        assert not subscriber.store_reading("a", "temperature", 1.0, "c", 100)
+    assert subscriber.messages_dropped == 3
+    assert not subscriber.write_queue
+
+
+@pytest.mark.parametrize("timestamp", [
+    1772274618.075768,        # seconds
+    1772274618075.768,        # milliseconds
+    1772274618075768,         # microseconds
+    1772274618075768000,      # nanoseconds
+])
+def test_numeric_timestamps_are_normalised_by_magnitude(timestamp):
+    assert subscriber.to_epoch_us(timestamp) == pytest.approx(1772274618075768, abs=1)
+
+
+def load_subscriber(monkeypatch, hidden):
+    """Load a fresh copy of subscriber.py with the given JSON libraries made unimportable"""
+    for name in hidden:
+        monkeypatch.setitem(sys.modules, name, None)
+    spec = importlib.util.spec_from_file_location(f"subscriber_without_{'_'.join(hidden)}", subscriber.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=["msgspec", "orjson", "json"])
+def decoder_module(request, monkeypatch):
+    """subscriber as loaded with each of the three payload decoders"""
+    if request.param != "json":
+        pytest.importorskip(request.param)
+    hidden = {"msgspec": [], "orjson": ["msgspec"], "json": ["msgspec", "orjson"]}[request.param]
+    return load_subscriber(monkeypatch, hidden)
+
+
+@pytest.mark.parametrize("payload, expected", [
+    (b'{"value": 23.5, "unit": "celsius"}', 23.5),
+    (b'{"value": "23.5"}', 23.5),
+    (b'{"value": 23.5, "unit": null}', 23.5),
+    (b'{"value": true}', None),
+    (b'{"value": Infinity}', None),
+    (b'{"value": 1e999}', None),
+    (b'{"value": "inf"}', None),
+    (b'{"value": "nan"}', None),
+    (b'{"value": 23.5, "unit": 5}', None),
+    (b'{"value": 23.5, "timestamp": "garbage"}', None),
+    (b'{"value": 23.5, "timestamp": true}', None),
+    (b'{"unit": "celsius"}', None),
+    (b'[1, 2]', None),
+    (b'"23.5"', None),
+    (b'not json', None),
+])
+def test_decoders_agree_on_payloads(decoder_module, monkeypatch, caplog, payload, expected):
+    stored = []
+    monkeypatch.setattr(decoder_module, "store_reading", lambda *row: stored.append(row))
+    msg = types.SimpleNamespace(topic="sensors/rpi/temperature", payload=payload)
+    
+    with caplog.at_level(logging.WARNING):
+        decoder_module.handle_reading(msg, "rpi", "temperature")
+    
+    assert [row[2] for row in stored] == ([expected] if expected is not None else [])
+    # Bad payloads are warnings, never unexpected errors
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+
+
+@pytest.mark.parametrize("callback, topic", [
+    (subscriber.on_temperature, "sensors//temperature"),
+    (subscriber.on_humidity, "sensors//humidity"),
+])
+def test_empty_sensor_name_is_rejected(monkeypatch, caplog, callback, topic):
+    handled = []
+    monkeypatch.setattr(subscriber, "handle_reading", lambda *args: handled.append(args))
+    msg = types.SimpleNamespace(topic=topic, payload=b'{"value": 1}')
+    
+    with caplog.at_level(logging.WARNING):
+        callback(None, None, msg)
+    
+    assert not handled
+    assert f"Unexpected topic format: {topic}" in caplog.text
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (None, 1),
+    ("4", 4),
+    ("four", None),
+    ("0", None),
+    ("-2", None),
+])
+def test_worker_count_comes_from_environment(monkeypatch, caplog, raw, expected):
+    if raw is None:
+        monkeypatch.delenv("SUBSCRIBER_WORKERS", raising=False)
+    else:
+        monkeypatch.setenv("SUBSCRIBER_WORKERS", raw)
+    
+    assert subscriber.parse_workers() == expected
+    if expected is None:
+        assert "SUBSCRIBER_WORKERS must be a positive integer" in caplog.text